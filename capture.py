@@ -6,8 +6,28 @@ GridSeis Data Capture - Auto-detects ESP32 and logs frequency data.
 import serial
 import serial.tools.list_ports
 import json
+import os
+import queue
+import signal
+import threading
+import time
 from datetime import datetime
 
+try:
+    import orjson
+    json_loads, json_dumps = orjson.loads, orjson.dumps
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj).encode()
+
+FLUSH_INTERVAL = 1.0  # seconds between flushes of the log file
+PRINT_INTERVAL = 1.0  # seconds between console status lines
+QUEUE_SIZE = 4096  # lines buffered between the serial reader and the file writer
+BATCH_SIZE = 64  # max queued lines taken off the queue per pass of the writer
+WRITE_SIZE = 64 * 1024  # bytes of pending records that trigger a write
+
 
 def find_esp32():
     """Find ESP32 serial port automatically."""
@@ -23,6 +43,28 @@ def find_esp32():
     return None
 
 
+def read_lines(ser):
+    """Yield complete lines from the serial port, draining its buffer in one read."""
+    buf = bytearray()
+    while True:
+        buf.extend(ser.read(ser.in_waiting or 1))
+        while (nl := buf.find(b'\n')) >= 0:
+            yield bytes(buf[:nl])
+            del buf[:nl + 1]
+
+
+def write_all(fd, buf):
+    """Write the buffer to the file descriptor, removing each chunk once it is on disk."""
+    while buf:
+        del buf[:os.write(fd, buf)]
+
+
+def reader(ser, q):
+    """Push timestamped serial lines onto the queue."""
+    for raw in read_lines(ser):
+        q.put((time.time_ns(), raw))
+
+
 def main():
     port = find_esp32()
     if not port:
@@ -38,21 +80,69 @@ def main():
     print(f"Logging to {output_file}")
     print("Press Ctrl+C to stop.\n")
 
-    with open(output_file, 'w') as f:
-        try:
-            while True:
-                line = ser.readline().decode('utf-8', errors='ignore').strip()
-                if line.startswith('{') and line.endswith('}'):
-                    try:
-                        data = json.loads(line)
-                        data['wall_time'] = datetime.now().isoformat()
-                        f.write(json.dumps(data) + '\n')
-                        f.flush()
-                        print(f"{data['freq']:.4f} Hz | signal: {data['signal']:.3f}")
-                    except (json.JSONDecodeError, KeyError):
-                        pass
-        except KeyboardInterrupt:
+    # Drain the port on its own thread so slow disk writes can't overrun the UART buffer
+    q = queue.Queue(maxsize=QUEUE_SIZE)
+    reader_thread = threading.Thread(target=reader, args=(ser, q), daemon=True)
+    reader_thread.start()
+
+    # Records accumulate in one reused buffer and go to disk in a single write
+    # once it fills or the flush interval passes. O_BINARY stops Windows turning \n into \r\n.
+    fd = os.open(output_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+    buf = bytearray()
+    last_flush = last_print = time.monotonic()
+    latest = None
+
+    # Ctrl+C only sets a flag checked between passes. A KeyboardInterrupt raised after
+    # os.write() but before the buffer is trimmed would make the final flush repeat records.
+    stop = threading.Event()
+    previous_sigint = signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    try:
+        while not stop.is_set():
+            try:
+                batch = [q.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                if not reader_thread.is_alive():
+                    break
+                batch = []
+            # Take whatever else is already queued in the same pass
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Nearly every line is a valid record, so parsing straight away and catching
+            # the odd boot message or noise is cheaper than pre-checking every line
+            for wall_time_ns, line in batch:
+                try:
+                    data = json_loads(line)
+                    data['wall_time_ns'] = wall_time_ns
+                    buf += json_dumps(data)
+                    buf += b'\n'
+                    latest = data
+                except (json.JSONDecodeError, UnicodeDecodeError, TypeError):
+                    pass
+            now = time.monotonic()
+            if len(buf) >= WRITE_SIZE or now - last_flush > FLUSH_INTERVAL:
+                write_all(fd, buf)
+                last_flush = now
+            # Field lookups and formatting happen here, at most once per interval
+            if latest is not None and now - last_print > PRINT_INTERVAL:
+                try:
+                    freq_val = latest['freq']
+                    sig_val = latest['signal']
+                    print(f"{freq_val:.4f} Hz | signal: {sig_val:.3f}")
+                except KeyError:
+                    pass
+                last_print = now
+                latest = None
+        if stop.is_set():
             print("\nDone.")
+    finally:
+        signal.signal(signal.SIGINT, previous_sigint)
+        write_all(fd, buf)
+        os.fsync(fd)
+        os.close(fd)
 
 
 if __name__ == '__main__':
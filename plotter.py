@@ -1,89 +1,139 @@
 import json
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from datetime import datetime, timezone
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from pathlib import Path
+from typing import Optional
 import glob
 import sys
 import numpy as np
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+@dataclass
+class LogSeries:
+    """Frequency time series held as NumPy arrays."""
+    t: np.ndarray  # datetime64[us], naive UTC
+    f: np.ndarray  # float64, Hz
+    board: Optional[str] = None  # None for the National Grid reference
+
+def to_naive_utc(stamp):
+    """Return an ISO timestamp as naive UTC, ready for NumPy to parse."""
+    if stamp.endswith('Z'):
+        return stamp[:-1]
+    if stamp.endswith('+00:00'):
+        return stamp[:-6]
+    t = datetime.fromisoformat(stamp)
+    if t.tzinfo is None:
+        return stamp
+    return t.astimezone(timezone.utc).replace(tzinfo=None).isoformat()
+
 def load_grid_reference(json_path):
     """Load National Grid reference frequency data from JSON file."""
-    with open(json_path, 'r') as f:
-        data = json.load(f)
-    times = [datetime.fromisoformat(d['measurementTime'].replace('Z', '+00:00')) for d in data]
-    freqs = [d['frequency'] for d in data]
-    return times, freqs
+    with open(json_path, 'rb') as f:
+        data = json_loads(f.read())
+    # Normalise to naive UTC so NumPy parses them in C like the ESP32 logs
+    times = np.array([to_naive_utc(d['measurementTime']) for d in data], dtype='datetime64[us]')
+    freqs = np.array([d['frequency'] for d in data], dtype=np.float64)
+    return LogSeries(times, freqs)
 
 def load_esp32_log(log_file, time_offset_hours=0, invert_freq=True, use_smoothed=False):
     """Load ESP32 captured frequency data from JSONL file."""
-    times, freqs, board = [], [], None
-    offset = timedelta(hours=time_offset_hours)
+    stamps, fs, board = [], [], None
     freq_key = 'smoothed' if use_smoothed else 'freq'
-    with open(log_file, 'r') as f:
-        for line in f:
-            try:
-                d = json.loads(line.strip())
-                if 'wall_time' in d and freq_key in d:
-                    times.append(datetime.fromisoformat(d['wall_time']) + offset)
-                    freq = d[freq_key]
-                    if invert_freq:
-                        # Invert around 50Hz: 50.1 -> 49.9, 49.9 -> 50.1
-                        freq = 100.0 - freq
-                    freqs.append(freq)
-                    board = d.get('board', Path(log_file).stem)
-            except json.JSONDecodeError:
-                continue
-    return times, freqs, board
-
-def find_optimal_offset(ref_times, ref_freqs, esp_times, esp_freqs):
-    """Find optimal time offset using cross-correlation."""
-    # Resample both to common 15-second intervals
-    ref_start = min(ref_times)
-    ref_end = max(ref_times)
-
-    # Try offsets from -2 hours to +2 hours in 1-minute steps
-    best_offset = 0
-    best_corr = -999
-
-    for offset_min in range(-120, 121, 1):
-        offset = timedelta(minutes=offset_min)
-        shifted_esp_times = [t + offset for t in esp_times]
-
-        # Find overlapping region
-        overlap_start = max(ref_start, min(shifted_esp_times))
-        overlap_end = min(ref_end, max(shifted_esp_times))
-
-        if overlap_start >= overlap_end:
+    # Read the whole log at once; orjson parses each line straight from bytes
+    with open(log_file, 'rb') as f:
+        lines = f.read().splitlines()
+    for line in lines:
+        if not line:
             continue
-
-        # Resample to common times (15-sec intervals)
-        common_times = []
-        t = overlap_start
-        while t <= overlap_end:
-            common_times.append(t)
-            t += timedelta(seconds=15)
-
-        if len(common_times) < 10:
+        try:
+            d = json_loads(line)
+            stamp = d.get('wall_time_ns', d.get('wall_time'))
+            if stamp is not None and freq_key in d:
+                stamps.append(stamp)
+                fs.append(d[freq_key])
+                board = d.get('board', Path(log_file).stem)
+        except json.JSONDecodeError:
             continue
+    # Older logs store ISO wall_time strings, newer ones wall_time_ns since the epoch;
+    # NumPy converts either in C and applies offset/inversion in one pass
+    if stamps and isinstance(stamps[0], str):
+        times = np.array(stamps, dtype='datetime64[us]')
+    else:
+        times = np.array(stamps, dtype='datetime64[ns]').astype('datetime64[us]')
+    times += np.timedelta64(round(time_offset_hours * 3600e6), 'us')
+    freqs = np.asarray(fs, dtype=np.float64)
+    if invert_freq:
+        # Invert around 50Hz: 50.1 -> 49.9, 49.9 -> 50.1
+        freqs = 100.0 - freqs
+    return LogSeries(times, freqs, board)
+
+def to_timestamps(times):
+    """Convert a datetime64 array to float UNIX seconds."""
+    return times.astype('datetime64[us]').astype(np.int64) / 1e6
+
+def find_optimal_offset(ref, esp):
+    """Find optimal time offset of an ESP32 series against the reference using cross-correlation."""
+    step = 15.0
+    ref_ts = to_timestamps(ref.t)
+    esp_ts = to_timestamps(esp.t)
+
+    # Resample both once to a common 15-second grid anchored at the ESP32 start,
+    # so shifting the ESP32 data by whole minutes is just an index lag
+    t0 = esp_ts.min()
+    ref_idx = np.arange(int(np.ceil((ref_ts.min() - t0) / step)), int((ref_ts.max() - t0) // step) + 1)
+    esp_idx = np.arange(int((esp_ts.max() - t0) // step) + 1)
+    ref_grid = np.interp(t0 + step * ref_idx, ref_ts, ref.f)
+    esp_grid = np.interp(t0 + step * esp_idx, esp_ts, esp.f)
 
-        # Interpolate both signals
-        ref_interp = np.interp(
-            [t.timestamp() for t in common_times],
-            [t.timestamp() for t in ref_times],
-            ref_freqs
-        )
-        esp_interp = np.interp(
-            [t.timestamp() for t in common_times],
-            [t.timestamp() for t in shifted_esp_times],
-            esp_freqs
-        )
-
-        # Compute correlation
-        corr = np.corrcoef(ref_interp, esp_interp)[0, 1]
-        if corr > best_corr:
-            best_corr = corr
-            best_offset = offset_min
+    best_offset = 0
+    best_corr = -999
+    if len(ref_grid):
+        # Pearson correlation is shift-invariant; centring keeps the sums below well conditioned
+        ref_grid -= ref_grid.mean()
+        esp_grid -= esp_grid.mean()
+
+        # Sum of products at every lag in one FFT cross-correlation
+        n = len(ref_grid) + len(esp_grid) - 1
+        sxy_all = np.fft.irfft(np.fft.rfft(ref_grid, n) * np.fft.rfft(esp_grid[::-1], n), n)
+
+        # Try offsets from -2 hours to +2 hours in 1-minute steps; for each, lag is the
+        # reference grid index that lines up with the first ESP32 grid sample
+        offsets = np.arange(-120, 121)
+        lag = offsets * int(60 // step) - ref_idx[0]
+        lo = np.maximum(lag, 0)
+        hi = np.minimum(lag + len(esp_grid), len(ref_grid))
+        count = hi - lo
+        keep = count >= 10
+        offsets, lag, lo, hi, count = offsets[keep], lag[keep], lo[keep], hi[keep], count[keep]
+
+        # Per-lag sums over just the overlapping samples, from prefix sums
+        def window_sum(x, a, b):
+            c = np.concatenate(([0.0], np.cumsum(x)))
+            return c[b] - c[a]
+
+        sx = window_sum(ref_grid, lo, hi)
+        sy = window_sum(esp_grid, lo - lag, hi - lag)
+        sxx = window_sum(ref_grid ** 2, lo, hi)
+        syy = window_sum(esp_grid ** 2, lo - lag, hi - lag)
+        sxy = sxy_all[lag + len(esp_grid) - 1]
+
+        # A flat window has no meaningful correlation; rounding residue in its variance
+        # would otherwise blow the ratio up to inf
+        var_x = sxx - sx ** 2 / count
+        var_y = syy - sy ** 2 / count
+        flat = (var_x <= 1e-12 * count) | (var_y <= 1e-12 * count)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.clip((sxy - sx * sy / count) / np.sqrt(var_x * var_y), -1.0, 1.0)
+        corr[flat] = np.nan
+        if np.isfinite(corr).any():
+            i = np.nanargmax(corr)
+            best_offset, best_corr = int(offsets[i]), float(corr[i])
 
     print(f"Optimal offset: {best_offset} minutes (correlation: {best_corr:.4f})")
     return best_offset
@@ -93,23 +143,22 @@ def plot_grid_frequency(reference_json=None, log_files=None):
     fig, ax = plt.subplots(figsize=(12, 6))
 
     # Load reference data
-    ref_times, ref_freqs = None, None
     if reference_json:
-        ref_times, ref_freqs = load_grid_reference(reference_json)
-        ax.plot(ref_times, ref_freqs, 'b-', linewidth=1.5, label='National Grid Reference', alpha=0.8)
-        print(f"Loaded {len(ref_freqs)} reference samples from {reference_json}")
-        print(f"  Time range: {ref_times[0]} to {ref_times[-1]}")
-        print(f"  Frequency range: {min(ref_freqs):.3f} - {max(ref_freqs):.3f} Hz")
+        ref = load_grid_reference(reference_json)
+        ax.plot(ref.t, ref.f, 'b-', linewidth=1.5, label='National Grid Reference', alpha=0.8)
+        print(f"Loaded {len(ref.f)} reference samples from {reference_json}")
+        print(f"  Time range: {ref.t[0]} to {ref.t[-1]}")
+        print(f"  Frequency range: {ref.f.min():.3f} - {ref.f.max():.3f} Hz")
 
     # Load and plot captured ESP32 data
     if log_files:
         for log_file in log_files:
-            esp_times, esp_freqs, board = load_esp32_log(log_file, time_offset_hours=0, invert_freq=True)
-            if not esp_times:
+            esp = load_esp32_log(log_file, time_offset_hours=0, invert_freq=True)
+            if len(esp.t) == 0:
                 continue
 
-            ax.plot(esp_times, esp_freqs, '.', markersize=2, label=f'ESP32: {board}', alpha=0.6)
-            print(f"Loaded {len(esp_freqs)} samples from {log_file}")
+            ax.plot(esp.t, esp.f, '.', markersize=2, label=f'ESP32: {esp.board}', alpha=0.6)
+            print(f"Loaded {len(esp.f)} samples from {log_file}")
 
     ax.axhline(y=50.0, color='gray', linestyle='--', alpha=0.5, label='50 Hz nominal')
     ax.set_xlabel('Time (UTC)')
@@ -121,8 +170,7 @@ def plot_grid_frequency(reference_json=None, log_files=None):
     ax.xaxis.set_major_locator(mdates.MinuteLocator(interval=5))
 
     # Truncate to 15:23-15:58 UTC
-    ax.set_xlim(datetime(2025, 12, 10, 15, 23, tzinfo=ref_times[0].tzinfo if ref_times else None),
-                datetime(2025, 12, 10, 15, 58, tzinfo=ref_times[0].tzinfo if ref_times else None))
+    ax.set_xlim(np.datetime64('2025-12-10T15:23'), np.datetime64('2025-12-10T15:58'))
     fig.autofmt_xdate()
 
     # Save plot